@@ -1,7 +1,7 @@
 """
 Multi-agent system for code review
 """
-from typing import List
+from typing import AsyncIterator, List, NamedTuple, Optional
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain.schema import HumanMessage, SystemMessage
@@ -9,17 +9,270 @@ from models import CodeDiff, ReviewComment, ReviewCategory
 from config import settings
 from watsonx_llm import WatsonxChat
 from openrouter_llm import OpenRouterChat
+from ttl_cache import TTLCache
+import asyncio
+import functools
+import hashlib
 import json
-import re
+import logging
+import threading
+
+import orjson
+
+
+log = logging.getLogger("pr_review.agents")
+
+# Shared opening of every review prompt; must not vary by agent (see _build_prompt)
+REVIEWER_PREAMBLE = """You are an expert code reviewer. You will be given a code change to review, \
+followed by instructions describing which issues to look for and how to format your review.
+"""
+
+
+# Longest Retry-After we'll wait before retrying a rate-limited agent
+MAX_RETRY_AFTER = 10.0
+
+# Rough size of a token, used when the tokenizer can't be loaded
+CHARS_PER_TOKEN = 4
+
+# Reused decoder for pulling the JSON object out of LLM responses
+_JSON_DECODER = json.JSONDecoder()
+
+# Sort order for comments on the same line, most severe first
+SEVERITY_RANK = {"critical": 0, "major": 1, "minor": 2, "suggestion": 3}
+
+# Module-level cache of review results (shared across agents and requests),
+# mapping cache key -> tuple of comments
+_review_cache = TTLCache(settings.review_cache_size, settings.review_cache_ttl)
+
+
+def _extract_fenced_json(text: str):
+    """Return the body of the first ``` code block in text, or None"""
+    fence_idx = text.find('```')
+    if fence_idx == -1:
+        return None
+    # Skip the rest of the opening fence line (e.g. the "json" language tag)
+    body_start = text.find('\n', fence_idx) + 1
+    if body_start == 0:
+        return None
+    body_end = text.find('```', body_start)
+    return text[body_start:body_end] if body_end != -1 else None
+
+
+def _comment_sort_key(comment: ReviewComment) -> tuple:
+    """Sort comments by line number, most severe first within a line"""
+    return comment.line_number, SEVERITY_RANK.get(comment.severity, len(SEVERITY_RANK))
+
+
+def _normalize_diff(diff_text: str) -> str:
+    """
+    Normalize a diff so blob hashes and trailing whitespace don't affect its cache key
+    
+    Hunk headers and indentation are kept: comments carry line numbers, and in
+    Python an indentation change can change behavior.
+    """
+    lines = []
+    for line in diff_text.split('\n'):
+        if line.startswith('index '):
+            continue
+        lines.append(line.rstrip())
+    return '\n'.join(lines)
+
+
+def _review_cache_keys(cache_id: str, diff: CodeDiff) -> tuple:
+    """Exact and structural cache keys for an agent's review of a diff"""
+    exact = hashlib.blake2b(f"{cache_id}|{diff.diff_text}".encode(), digest_size=16).hexdigest()
+    structural = hashlib.blake2b(f"{cache_id}|{_normalize_diff(diff.diff_text)}".encode(), digest_size=16).hexdigest()
+    return exact, "s:" + structural
+
+
+def _get_cached_review(keys: tuple):
+    """Return cached comments for the first live key, or None"""
+    for key in keys:
+        comments = _review_cache.get(key)
+        if comments is not None:
+            # Hand out copies so callers never share comment objects
+            return [comment.model_copy() for comment in comments]
+    return None
+
+
+def _cache_review(keys: tuple, comments: List[ReviewComment]):
+    """Store comments under all keys, evicting the least recently used entries"""
+    entry = tuple(comments)
+    for key in keys:
+        _review_cache.put(key, entry)
+
+
+# tiktoken downloads its BPE file on first use, with no timeout, so the encoding is
+# loaded in a background thread; until it's ready, token counts are estimated from length
+_tokenizer = None
+_tokenizer_thread: Optional[threading.Thread] = None
+_tokenizer_lock = threading.Lock()
+
+
+def _load_tokenizer():
+    """Load the tiktoken encoding into _tokenizer, leaving it None if unavailable (e.g. offline)"""
+    global _tokenizer
+    try:
+        import tiktoken
+        _tokenizer = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        log.warning("tiktoken unavailable, estimating tokens from length: %s", e)
+
+
+def _get_tokenizer():
+    """Return the tiktoken encoding if loaded, starting the background load on first call"""
+    global _tokenizer_thread
+    if _tokenizer_thread is None:
+        with _tokenizer_lock:
+            if _tokenizer_thread is None:
+                _tokenizer_thread = threading.Thread(target=_load_tokenizer, name="tiktoken-load", daemon=True)
+                _tokenizer_thread.start()
+    return _tokenizer
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Truncate text to at most max_tokens tokens; returns text itself if it fits"""
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        return text if len(text) <= max_chars else text[:max_chars]
+    
+    # Every token covers at least one character
+    if len(text) <= max_tokens:
+        return text
+    # Don't tokenize more of a huge diff than could possibly fit
+    tokens = tokenizer.encode(text[:max_tokens * 16], disallowed_special=())
+    if len(tokens) <= max_tokens and len(text) <= max_tokens * 16:
+        return text
+    return tokenizer.decode(tokens[:max_tokens])
+
+
+class _RequestPacer:
+    """Spaces out request start times to stay under a provider's rate limit"""
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_slot = 0.0
+    
+    async def wait(self):
+        """Wait until the next request slot is available"""
+        now = asyncio.get_running_loop().time()
+        # Reserve a slot before sleeping so concurrent callers queue up behind it
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+@functools.lru_cache(maxsize=8)
+def _make_llm(provider: str, model_name: str, temperature: float, max_tokens: int):
+    """Create the LLM client for a configuration, shared by every agent that uses it"""
+    if provider == "openrouter":
+        if not settings.openrouter_api_key:
+            raise ValueError(
+                "OpenRouter API key is required. "
+                "Please create a .env file with OPENROUTER_API_KEY. "
+                "You can copy .env.example to .env and fill in your credentials."
+            )
+        return OpenRouterChat(
+            api_key=settings.openrouter_api_key,
+            model_id=model_name,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+    elif provider == "watsonx":
+        if not settings.watsonx_api_key or not settings.watsonx_project_id:
+            raise ValueError(
+                "Watsonx API key and project ID are required. "
+                "Please create a .env file with WATSONX_API_KEY and WATSONX_PROJECT_ID. "
+                "You can copy .env.example to .env and fill in your credentials."
+            )
+        # Get URL - remove protocol if present, watsonx_llm will add it
+        watsonx_url = settings.watsonx_url or "us-south.ml.cloud.ibm.com"
+        # Remove protocol prefix if present
+        if watsonx_url.startswith("http://") or watsonx_url.startswith("https://"):
+            watsonx_url = watsonx_url.replace("http://", "").replace("https://", "")
+        
+        return WatsonxChat(
+            api_key=settings.watsonx_api_key,
+            project_id=settings.watsonx_project_id,
+            url=watsonx_url,
+            model_id=model_name,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+    elif provider == "anthropic":
+        return ChatAnthropic(
+            model=model_name if "claude" in model_name else "claude-3-opus-20240229",
+            temperature=temperature,
+            api_key=settings.anthropic_api_key
+        )
+    else:
+        return ChatOpenAI(
+            model=model_name if "gpt" in model_name else "gpt-4-turbo-preview",
+            temperature=temperature,
+            api_key=settings.openai_api_key
+        )
+
+
+class LLMResult(NamedTuple):
+    """Outcome of one agent review; error is set instead of raising when the LLM call fails"""
+    comments: List[ReviewComment]
+    error: Optional[str]
+    rate_limited: bool
+    retry_after: Optional[float] = None  # Seconds the provider asked us to wait, if it said
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Find a Retry-After delay (in seconds) on the HTTP response behind an exception"""
+    # LLM wrappers re-raise with their own message, so walk the chain to the original error
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        response = getattr(exc, "response", None)
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            try:
+                return float(headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass  # Missing, or an HTTP date; fall back to our own backoff
+        exc = exc.__cause__ or exc.__context__
+    return None
 
 
 class ReviewAgent:
     """Base class for review agents"""
     
+    # Review request and output format, formatted once per agent in __init__
+    INSTRUCTIONS_TEMPLATE = """
+Please review the code changes above and identify issues related to {category}.
+
+Provide your review in the following JSON format:
+{{
+    "comments": [
+        {{
+            "line_number": <line number>,
+            "severity": "<critical|major|minor|suggestion>",
+            "title": "<brief title>",
+            "description": "<detailed description>",
+            "code_snippet": "<relevant code snippet>",
+            "suggestion": "<suggested fix>"
+        }}
+    ]
+}}
+
+Only include issues that are relevant to {category}. If no issues are found, return an empty comments array.
+"""
+    
     def __init__(self, category: ReviewCategory, system_prompt: str):
         self.category = category
+        self.name = category.value
+        # Identifies this agent's results in the review cache
+        self.cache_id = self.name
         self.system_prompt = system_prompt
         self._llm = None  # Lazy initialization
+        # The category part of the prompt never changes, so build it once
+        self._review_request = HumanMessage(content=f"{system_prompt}\n{self._build_instructions()}")
     
     @property
     def llm(self):
@@ -30,55 +283,16 @@ class ReviewAgent:
     
     def _get_llm(self):
         """Initialize LLM based on configuration"""
-        if settings.llm_provider == "openrouter":
-            if not settings.openrouter_api_key:
-                raise ValueError(
-                    "OpenRouter API key is required. "
-                    "Please create a .env file with OPENROUTER_API_KEY. "
-                    "You can copy .env.example to .env and fill in your credentials."
-                )
-            return OpenRouterChat(
-                api_key=settings.openrouter_api_key,
-                model_id=settings.model_name,
-                temperature=settings.temperature,
-                max_tokens=settings.max_tokens
-            )
-        elif settings.llm_provider == "watsonx":
-            if not settings.watsonx_api_key or not settings.watsonx_project_id:
-                raise ValueError(
-                    "Watsonx API key and project ID are required. "
-                    "Please create a .env file with WATSONX_API_KEY and WATSONX_PROJECT_ID. "
-                    "You can copy .env.example to .env and fill in your credentials."
-                )
-            # Get URL - remove protocol if present, watsonx_llm will add it
-            watsonx_url = settings.watsonx_url or "us-south.ml.cloud.ibm.com"
-            # Remove protocol prefix if present
-            if watsonx_url.startswith("http://") or watsonx_url.startswith("https://"):
-                watsonx_url = watsonx_url.replace("http://", "").replace("https://", "")
-            
-            return WatsonxChat(
-                api_key=settings.watsonx_api_key,
-                project_id=settings.watsonx_project_id,
-                url=watsonx_url,
-                model_id=settings.model_name,
-                temperature=settings.temperature,
-                max_tokens=settings.max_tokens
-            )
-        elif settings.llm_provider == "anthropic":
-            return ChatAnthropic(
-                model=settings.model_name if "claude" in settings.model_name else "claude-3-opus-20240229",
-                temperature=settings.temperature,
-                api_key=settings.anthropic_api_key
-            )
-        else:
-            return ChatOpenAI(
-                model=settings.model_name if "gpt" in settings.model_name else "gpt-4-turbo-preview",
-                temperature=settings.temperature,
-                api_key=settings.openai_api_key
-            )
+        return _make_llm(settings.llm_provider, settings.model_name, settings.temperature, settings.max_tokens)
     
-    async def review(self, diff: CodeDiff) -> List[ReviewComment]:
-        """Review a code diff and return comments"""
+    async def review(self, diff: CodeDiff) -> "LLMResult":
+        """Review a code diff; LLM errors are reported in the result, not raised"""
+        # Unchanged diffs (re-runs, replayed PRs) are served from the cache
+        cache_keys = _review_cache_keys(self.cache_id, diff)
+        cached = _get_cached_review(cache_keys)
+        if cached is not None:
+            return LLMResult(cached, None, False)
+        
         prompt = self._build_prompt(diff)
         try:
             response = await self.llm.ainvoke(prompt)
@@ -94,142 +308,149 @@ class ReviewAgent:
             else:
                 response_text = str(response)
         except Exception as e:
-            # Log the error and re-raise
-            error_msg = f"Error calling LLM for {self.category.value} review: {str(e)}"
-            print(f"Warning: {error_msg}")
-            raise Exception(error_msg)
+            # Log the error and hand it back to the caller
+            error_str = str(e)
+            error_msg = f"Error calling LLM for {self.name} review: {error_str}"
+            log.warning("%s", error_msg)
+            rate_limited = "429" in error_str or "rate_limit" in error_str.lower()
+            return LLMResult([], error_msg, rate_limited, _retry_after(e) if rate_limited else None)
         
-        comments = self._parse_response(response_text, diff.file_path)
-        return comments
+        comments = self._parse_comments(response_text, diff.file_path)
+        if comments is None:
+            # Unparseable output isn't cached, so the next run asks the LLM again
+            return LLMResult(self._fallback_comments(response_text, diff.file_path), None, False)
+        # Only decoded reviews reach the cache (clean ones included), so errors are retried next time
+        _cache_review(cache_keys, comments)
+        return LLMResult(comments, None, False)
     
     def _build_prompt(self, diff: CodeDiff) -> List:
         """Build the prompt for the agent"""
-        # Limit diff text size to avoid token limits and speed up processing
-        MAX_DIFF_LENGTH = 5000  # Limit to ~5000 chars per file
-        diff_text_limited = diff.diff_text[:MAX_DIFF_LENGTH] if len(diff.diff_text) > MAX_DIFF_LENGTH else diff.diff_text
-        if len(diff.diff_text) > MAX_DIFF_LENGTH:
+        # The system message is identical for every agent reviewing the same diff and
+        # only the trailing message varies by category, so providers with automatic
+        # prefix caching can reuse the processed diff context across agents
+        return [
+            SystemMessage(content=REVIEWER_PREAMBLE + self._build_code_context(diff)),
+            self._review_request
+        ]
+    
+    def _build_code_context(self, diff: CodeDiff) -> str:
+        """Build the code context section shared by all review categories"""
+        # Limit diff size by tokens to avoid token limits and speed up processing.
+        # The diff already contains the added and removed code, so the full
+        # old/new content is not sent separately
+        diff_text_limited = _truncate_to_tokens(diff.diff_text, settings.max_diff_tokens)
+        if diff_text_limited is not diff.diff_text:
             diff_text_limited += "\n... (diff truncated for review)"
         
-        # Limit code content size
-        new_content_limited = (diff.new_content or "N/A")[:2000] if diff.new_content and len(diff.new_content) > 2000 else (diff.new_content or "N/A")
-        old_content_limited = (diff.old_content or "N/A")[:2000] if diff.old_content and len(diff.old_content) > 2000 else (diff.old_content or "N/A")
-        
-        code_context = f"""
+        return f"""
 File: {diff.file_path}
 
 Diff:
 {diff_text_limited}
-
-New Code:
-{new_content_limited}
-
-Old Code:
-{old_content_limited}
 """
-        
-        return [
-            SystemMessage(content=self.system_prompt),
-            HumanMessage(content=f"""
-Please review the following code changes and identify issues related to {self.category.value}.
-
-{code_context}
-
-Provide your review in the following JSON format:
-{{
-    "comments": [
-        {{
-            "line_number": <line number>,
-            "severity": "<critical|major|minor|suggestion>",
-            "title": "<brief title>",
-            "description": "<detailed description>",
-            "code_snippet": "<relevant code snippet>",
-            "suggestion": "<suggested fix>"
-        }}
-    ]
-}}
-
-Only include issues that are relevant to {self.category.value}. If no issues are found, return an empty comments array.
-""")
-        ]
     
-    def _parse_response(self, response_text: str, file_path: str) -> List[ReviewComment]:
-        """Parse LLM response into ReviewComment objects"""
-        comments = []
+    def _build_instructions(self) -> str:
+        """Build the review request and expected output format"""
+        return self.INSTRUCTIONS_TEMPLATE.format(category=self.category.value)
+    
+    def _parse_comments(self, response_text: str, file_path: str) -> Optional[List[ReviewComment]]:
+        """
+        Parse the LLM response into ReviewComment objects
         
+        A decoded response with no comments is a clean review and gives []; None
+        means the output couldn't be decoded at all.
+        """
         try:
-            # Try to find JSON in the response - look for { ... } pattern
-            # First try to find JSON object boundaries more accurately
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}')
-            
-            if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-                json_str = response_text[start_idx:end_idx + 1]
-                try:
-                    data = json.loads(json_str)
-                    for comment_data in data.get("comments", []):
-                        try:
-                            comments.append(ReviewComment(
-                                file_path=file_path,
-                                line_number=int(comment_data.get("line_number", 0)),
-                                category=self.category,
-                                severity=comment_data.get("severity", "minor"),
-                                title=comment_data.get("title", "Review Comment"),
-                                description=comment_data.get("description", ""),
-                                code_snippet=comment_data.get("code_snippet"),
-                                suggestion=comment_data.get("suggestion")
-                            ))
-                        except Exception as e:
-                            # Skip invalid comment data
-                            print(f"Warning: Skipping invalid comment data: {e}")
-                            continue
-                except json.JSONDecodeError:
-                    # Try alternative: look for JSON with code blocks
-                    json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', response_text, re.DOTALL)
-                    if json_match:
-                        try:
-                            data = json.loads(json_match.group(1))
-                            for comment_data in data.get("comments", []):
-                                comments.append(ReviewComment(
-                                    file_path=file_path,
-                                    line_number=int(comment_data.get("line_number", 0)),
-                                    category=self.category,
-                                    severity=comment_data.get("severity", "minor"),
-                                    title=comment_data.get("title", "Review Comment"),
-                                    description=comment_data.get("description", ""),
-                                    code_snippet=comment_data.get("code_snippet"),
-                                    suggestion=comment_data.get("suggestion")
-                                ))
-                        except:
-                            pass
-            
-            # If no valid JSON found, create a fallback comment
-            if not comments:
-                # Try to extract any useful information from the response
-                description = response_text.strip()
-                if len(description) > 1000:
-                    description = description[:1000] + "..."
-                
-                comments.append(ReviewComment(
-                    file_path=file_path,
-                    line_number=0,
-                    category=self.category,
-                    severity="minor",
-                    title="Review Note",
-                    description=description
-                ))
+            data = self._extract_json(response_text)
+            if data is not None:
+                return self._comments_from_json(data, file_path)
         except Exception as e:
-            # Ultimate fallback: create a single comment with the raw response
-            print(f"Error parsing response: {e}")
-            comments.append(ReviewComment(
-                file_path=file_path,
-                line_number=0,
-                category=self.category,
-                severity="minor",
-                title="Review Note",
-                description=response_text[:500] if response_text else "No response received"
-            ))
+            log.warning("Error parsing response: %s", e)
+        return None
+    
+    def _fallback_comments(self, response_text: str, file_path: str) -> List[ReviewComment]:
+        """A single note carrying the raw response, for output that couldn't be parsed"""
+        if not response_text:
+            return [self._review_note(file_path, "No response received")]
         
-        return comments
+        # If no valid JSON found, create a fallback comment with whatever
+        # useful information the response holds
+        description = response_text.strip()
+        if len(description) > 1000:
+            description = description[:1000] + "..."
+        return [self._review_note(file_path, description)]
+    
+    def _review_note(self, file_path: str, description: str) -> ReviewComment:
+        """Build the fallback comment used when the response has no usable comments"""
+        # Every field is built here, so skip validation
+        return ReviewComment.model_construct(
+            file_path=file_path,
+            line_number=0,
+            category=self.category,
+            severity="minor",
+            title="Review Note",
+            description=description
+        )
+    
+    @staticmethod
+    def _extract_json(response_text: str):
+        """Find and decode the JSON object in an LLM response, or return None"""
+        start_idx = response_text.find('{')
+        if start_idx == -1:
+            return None
+        
+        # Fast path: the response is usually just the object, maybe with
+        # whitespace or a code fence around it
+        end_idx = response_text.rfind('}')
+        try:
+            return orjson.loads(response_text[start_idx:end_idx + 1])
+        except orjson.JSONDecodeError:
+            pass
+        
+        # Decode from the first '{'; raw_decode stops at the end of the object,
+        # so trailing text after the JSON needs no boundary search
+        try:
+            return _JSON_DECODER.raw_decode(response_text, start_idx)[0]
+        except json.JSONDecodeError:
+            pass
+        
+        # Try alternative: the first '{' was prose, so decode the markdown code block
+        fenced = _extract_fenced_json(response_text)
+        if fenced is None:
+            return None
+        try:
+            return _JSON_DECODER.raw_decode(fenced.strip())[0]
+        except json.JSONDecodeError:
+            return None
+    
+    def _comments_from_json(self, data: dict, file_path: str) -> List[ReviewComment]:
+        """Build comments from the decoded {"comments": [...]} response"""
+        return self._build_comments(data.get("comments", []), file_path, self.category)
+    
+    @staticmethod
+    def _build_comments(items: List[dict], file_path: str, category: ReviewCategory) -> List[ReviewComment]:
+        """Build ReviewComment objects from raw comment dicts, skipping invalid ones"""
+        comments = [ReviewAgent._build_comment(c, file_path, category) for c in items]
+        return [comment for comment in comments if comment is not None]
+    
+    @staticmethod
+    def _build_comment(comment_data: dict, file_path: str, category: ReviewCategory):
+        """Build one ReviewComment from a raw comment dict, or None if it is invalid"""
+        try:
+            return ReviewComment.model_validate({
+                "file_path": file_path,
+                "line_number": int(comment_data.get("line_number", 0)),
+                "category": category,
+                "severity": comment_data.get("severity", "minor"),
+                "title": comment_data.get("title", "Review Comment"),
+                "description": comment_data.get("description", ""),
+                "code_snippet": comment_data.get("code_snippet"),
+                "suggestion": comment_data.get("suggestion")
+            })
+        except Exception as e:
+            # Skip invalid comment data
+            log.warning("Skipping invalid comment data: %s", e)
+            return None
 
 
 class LogicReviewAgent(ReviewAgent):
@@ -311,6 +532,62 @@ Be thorough and prioritize critical security issues."""
         super().__init__(ReviewCategory.SECURITY, system_prompt)
 
 
+class CombinedReviewAgent(ReviewAgent):
+    """Agent that covers several review categories in a single LLM call"""
+    
+    def __init__(self, agents: List[ReviewAgent]):
+        self.categories = [agent.category for agent in agents]
+        sections = "\n\n".join(
+            f"## {agent.category.value.title()} Review\n{agent.system_prompt}" for agent in agents
+        )
+        system_prompt = (
+            "You are an expert code reviewer covering several review areas at once. "
+            "Review the code separately for each of the following areas.\n\n" + sections
+        )
+        # The first category is used for fallback and error comments
+        super().__init__(self.categories[0], system_prompt)
+        self.name = "combined"
+        # Combined agents over different category sets must not share cached results
+        self.cache_id = "combined:" + ",".join(sorted(category.value for category in self.categories))
+    
+    def _build_instructions(self) -> str:
+        """Ask for one JSON object with a comment list per category"""
+        category_names = ", ".join(category.value for category in self.categories)
+        category_keys = ",\n".join(f'    "{category.value}": [<comments>]' for category in self.categories)
+        return f"""
+Please review the code changes above and identify issues for each of these categories: {category_names}.
+
+Provide your review as a single JSON object with one key per category:
+{{
+{category_keys}
+}}
+
+Each <comments> entry is a list of objects in this format:
+{{
+    "line_number": <line number>,
+    "severity": "<critical|major|minor|suggestion>",
+    "title": "<brief title>",
+    "description": "<detailed description>",
+    "code_snippet": "<relevant code snippet>",
+    "suggestion": "<suggested fix>"
+}}
+
+Only list an issue under the category it belongs to. Use an empty list for categories with no issues.
+"""
+    
+    def _comments_from_json(self, data: dict, file_path: str) -> List[ReviewComment]:
+        """Build comments from the decoded {"<category>": [...]} response"""
+        comments = []
+        for key, items in data.items():
+            try:
+                category = ReviewCategory(key)
+            except ValueError:
+                continue
+            if category in self.categories and isinstance(items, list):
+                comments.extend(self._build_comments(items, file_path, category))
+        return comments
+
+
 class MultiAgentReviewer:
     """Orchestrates multiple review agents"""
     
@@ -322,80 +599,123 @@ class MultiAgentReviewer:
             "security": SecurityReviewAgent()
         }
         self.agents = list(self.all_agents.values())
+        # Combined mode sends one request per diff covering every category
+        self.combined_agent = CombinedReviewAgent(self.agents)
+        self.combined_quick_agent = CombinedReviewAgent([self.all_agents["logic"], self.all_agents["security"]])
+        # Start loading the tokenizer now, so it's usually ready by the first review
+        _get_tokenizer()
+        # Bound concurrent LLM calls; watsonx also has a rate limit of 2 requests per second
+        self._sem = asyncio.Semaphore(settings.max_concurrency)
+        self._pacer = _RequestPacer(0.55) if settings.llm_provider == "watsonx" else None
     
     def get_agents_for_review(self, quick_mode: bool = False):
         """Get agents to use based on review mode"""
+        if settings.combined_review:
+            return [self.combined_quick_agent if quick_mode else self.combined_agent]
         if quick_mode:
             # Quick mode: only Logic and Security (most critical)
             return [self.all_agents["logic"], self.all_agents["security"]]
         return self.agents
     
+    async def _run_agent(self, agent: ReviewAgent, diff: CodeDiff) -> List[ReviewComment]:
+        """Run a single agent with retries, bounded by the concurrency limit"""
+        max_retries = 2  # Reduced retries for faster failure
+        retry_delay = 0.8  # Reduced initial delay
+        
+        for attempt in range(max_retries):
+            async with self._sem:
+                if self._pacer:
+                    await self._pacer.wait()
+                result = await agent.review(diff)
+            
+            if result.error is None:
+                return result.comments
+            
+            if result.rate_limited:
+                if attempt < max_retries - 1:
+                    # Honour the provider's Retry-After (within reason), else back off exponentially
+                    if result.retry_after is not None:
+                        wait_time = min(result.retry_after, MAX_RETRY_AFTER)
+                    else:
+                        wait_time = retry_delay * (2 ** attempt)
+                    log.info("Rate limit hit for %s agent. Waiting %ss...", agent.name, wait_time)
+                    await asyncio.sleep(wait_time)
+                    continue
+                # Max retries reached - skip this agent
+                # Don't add fallback comment for rate limits to keep response clean
+                log.warning("%s agent skipped due to rate limiting", agent.name)
+                return []
+            
+            # Non-rate-limit error - skip this agent
+            log.warning("%s agent failed: %s", agent.name, result.error[:100])
+            return [ReviewComment.model_construct(
+                file_path=diff.file_path,
+                line_number=0,
+                category=agent.category,
+                severity="minor",
+                title=f"{agent.name.title()} Review Error",
+                description=f"Could not complete {agent.name} review: {result.error[:200]}"
+            )]
+        
+        return []
+    
     async def review_diff(self, diff: CodeDiff, quick_mode: bool = False) -> List[ReviewComment]:
         """Run all agents on a diff and collect comments"""
-        all_comments = []
-        
         # Get agents to use based on mode
         agents_to_use = self.get_agents_for_review(quick_mode)
         
-        # Run agents sequentially with minimal delay to avoid rate limits
-        # Watsonx has rate limit of 2 requests per second
-        import asyncio
-        for i, agent in enumerate(agents_to_use):
-            max_retries = 2  # Reduced retries for faster failure
-            retry_delay = 0.8  # Reduced initial delay
-            
-            for attempt in range(max_retries):
-                try:
-                    # Add delay between requests to respect rate limits
-                    # 0.55s delay = ~1.8 req/s, safely under 2 req/s limit
-                    if i > 0 or attempt > 0:
-                        await asyncio.sleep(0.55)  # Reduced from 0.6s
-                    
-                    comments = await agent.review(diff)
-                    all_comments.extend(comments)
-                    break  # Success, exit retry loop
-                    
-                except Exception as e:
-                    error_str = str(e)
-                    # Check if it's a rate limit error
-                    if "429" in error_str or "rate_limit" in error_str.lower():
-                        if attempt < max_retries - 1:
-                            # Exponential backoff for rate limits
-                            wait_time = retry_delay * (2 ** attempt)
-                            print(f"Rate limit hit for {agent.category.value} agent. Waiting {wait_time}s...")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        else:
-                            # Max retries reached - skip this agent
-                            print(f"Warning: {agent.category.value} agent skipped due to rate limiting")
-                    else:
-                        # Non-rate-limit error - skip this agent
-                        print(f"Warning: {agent.category.value} agent failed: {str(e)[:100]}")
-                    
-                    # Don't add fallback comment for rate limits to keep response clean
-                    if "429" not in error_str and "rate_limit" not in error_str.lower():
-                        all_comments.append(ReviewComment(
-                            file_path=diff.file_path,
-                            line_number=0,
-                            category=agent.category,
-                            severity="minor",
-                            title=f"{agent.category.value.title()} Review Error",
-                            description=f"Could not complete {agent.category.value} review: {str(e)[:200]}"
-                        ))
-                    break  # Exit retry loop
+        # Agents are independent, so run them concurrently; _run_agent never raises
+        results = await asyncio.gather(*(self._run_agent(agent, diff) for agent in agents_to_use))
+        all_comments = [comment for comments in results for comment in comments]
         
-        # Sort by line number and severity
-        all_comments.sort(key=lambda x: (x.line_number, x.severity == "critical", x.severity == "major"))
+        # Sort by line number, most severe first within a line
+        all_comments.sort(key=_comment_sort_key)
         
         return all_comments
     
+    async def review_diff_stream(self, diff: CodeDiff, quick_mode: bool = False) -> AsyncIterator[ReviewComment]:
+        """Run all agents on a diff, yielding each agent's comments as soon as it finishes"""
+        async for comment in self.review_diffs_stream([diff], quick_mode):
+            yield comment
+    
+    async def review_diffs_stream(self, diffs: List[CodeDiff], quick_mode: bool = False) -> AsyncIterator[ReviewComment]:
+        """Review multiple diffs, yielding comments in the order agents finish"""
+        agents_to_use = self.get_agents_for_review(quick_mode)
+        tasks = [
+            asyncio.ensure_future(self._run_agent(agent, diff))
+            for diff in diffs
+            for agent in agents_to_use
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                comments = await next_done
+                # Sort within each agent's batch; the full ordering isn't known until the end
+                comments.sort(key=_comment_sort_key)
+                for comment in comments:
+                    yield comment
+        finally:
+            # The client may disconnect mid-stream; don't leave LLM calls running
+            for task in tasks:
+                task.cancel()
+    
     async def review_diffs(self, diffs: List[CodeDiff], quick_mode: bool = False) -> List[ReviewComment]:
         """Review multiple diffs"""
-        all_comments = []
+        agents_to_use = self.get_agents_for_review(quick_mode)
         
-        for diff in diffs:
-            comments = await self.review_diff(diff, quick_mode)
-            all_comments.extend(comments)
+        # Run every (file, agent) pair at once; the semaphore in _run_agent bounds
+        # how many LLM calls are actually in flight
+        results = await asyncio.gather(*(
+            self._run_agent(agent, diff)
+            for diff in diffs
+            for agent in agents_to_use
+        ))
         
+        # gather preserves input order, so each file's results are consecutive
+        all_comments = []
+        per_file = len(agents_to_use)
+        for start in range(0, len(results), per_file):
+            file_comments = [comment for comments in results[start:start + per_file] for comment in comments]
+            # Sort by line number, most severe first within a line
+            file_comments.sort(key=_comment_sort_key)
+            all_comments.extend(file_comments)
         return all_comments
-
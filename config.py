@@ -4,6 +4,7 @@ Configuration settings for the PR Review Agent
 from pydantic_settings import BaseSettings
 from typing import Optional
 from dotenv import load_dotenv
+import importlib.util
 
 # Load .env file
 load_dotenv()
@@ -29,9 +30,17 @@ class Settings(BaseSettings):
     
     # GitHub Configuration
     github_base_url: str = "https://api.github.com"
+    github_cache_ttl: int = 60  # Seconds before cached GitHub responses are revalidated (0 disables)
     
     # Agent Configuration
     max_agents: int = 4  # Logic, Readability, Performance, Security
+    max_concurrency: int = 4  # Max LLM requests in flight at once
+    combined_review: bool = False  # Review all categories in one LLM call per diff
+    max_diff_tokens: int = 2000  # Diff tokens sent to the LLM per file
+    
+    # Review Cache Configuration
+    review_cache_ttl: int = 86400  # Seconds to keep cached agent results (0 disables)
+    review_cache_size: int = 1024  # Max cached entries
     
     model_config = {
         "env_file": ".env",
@@ -42,3 +51,7 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
+# httpx only speaks HTTP/2 with the optional h2 package (httpx[http2]); without it,
+# http2=True fails when the client is created, so clients fall back to HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
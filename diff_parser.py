@@ -6,6 +6,11 @@ from models import CodeDiff
 import re
 
 
+# Header patterns, compiled once at import and matched at the start of the line
+_OLD_PATH_RE = re.compile(r'--- a/(.+)$')
+_HUNK_RE = re.compile(r'@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+
+
 class DiffParser:
     """Parser for Git diff format"""
     
@@ -20,34 +25,78 @@ class DiffParser:
         Returns:
             List of CodeDiff objects
         """
-        diffs = []
-        current_file = None
-        current_diff_lines = []
-        current_file_path = None
-        added_lines = []
-        removed_lines = []
-        old_content_lines = []
-        new_content_lines = []
-        in_hunk = False
-        old_line_num = 0
-        new_line_num = 0
+        # Locals are annotated so the module can be compiled with mypyc (see README)
+        diffs: List[CodeDiff] = []
+        current_file_path: Optional[str] = None
+        added_lines: List[int] = []
+        removed_lines: List[int] = []
+        old_content_lines: List[str] = []
+        new_content_lines: List[str] = []
+        # The diff text of each file is sliced from the input in one go
+        # rather than rebuilt from a list of its lines
+        file_start: int = 0  # Offset of the current file's first line in diff_text
+        header_search_from: int = 0  # Offset just past the last file header found
+        in_hunk: bool = False
+        old_line_num: int = 0
+        new_line_num: int = 0
         
         for line in diff_text.split('\n'):
-            # File header
-            if line.startswith('diff --git'):
+            # Dispatch on the first character; code lines are by far the most common
+            tag = line[:1]
+            
+            # The '---'/'+++' file headers come before the first hunk of a file,
+            # so inside a hunk every '+'/'-' line is code (even '+++i;' or '--- x')
+            if tag == '+':
+                if in_hunk:
+                    # Added line
+                    added_lines.append(new_line_num)
+                    new_content_lines.append(line[1:])  # Remove '+' prefix
+                    new_line_num += 1
+            
+            elif tag == '-':
+                if in_hunk:
+                    # Removed line
+                    removed_lines.append(old_line_num)
+                    old_content_lines.append(line[1:])  # Remove '-' prefix
+                    old_line_num += 1
+                elif line.startswith('---'):
+                    # Extract file path
+                    match = _OLD_PATH_RE.match(line)
+                    if match:
+                        current_file_path = match.group(1)
+            
+            elif tag == ' ':
+                if in_hunk:
+                    # Context line (unchanged)
+                    old_line_num += 1
+                    new_line_num += 1
+            
+            elif tag == '@' and line.startswith('@@'):
+                # Hunk header
+                in_hunk = True
+                # Extract line numbers from hunk header: @@ -old_start,old_count +new_start,new_count @@
+                match = _HUNK_RE.match(line)
+                if match:
+                    old_line_num = int(match.group(1))
+                    new_line_num = int(match.group(2))
+            
+            elif tag == 'd' and line.startswith('diff --git'):
+                # File header - headers are only ever seen at the start of a line, so the
+                # next one in the text is this line (except for a header on the first line)
+                header_start = diff_text.find('\ndiff --git', header_search_from) + 1
+                if not header_search_from and diff_text.startswith('diff --git'):
+                    header_start = 0
+                header_search_from = header_start + 1
+                
                 # Save previous file if exists
-                if current_file_path and current_diff_lines:
-                    diffs.append(CodeDiff(
-                        file_path=current_file_path,
-                        old_content='\n'.join(old_content_lines) if old_content_lines else None,
-                        new_content='\n'.join(new_content_lines) if new_content_lines else None,
-                        added_lines=added_lines,
-                        removed_lines=removed_lines,
-                        diff_text='\n'.join(current_diff_lines)
+                if current_file_path:
+                    diffs.append(DiffParser._build_diff(
+                        current_file_path, old_content_lines, new_content_lines, added_lines, removed_lines,
+                        diff_text[file_start:header_start - 1]  # Drop the newline before this header
                     ))
                 
                 # Reset for new file
-                current_diff_lines = [line]
+                file_start = header_start
                 added_lines = []
                 removed_lines = []
                 old_content_lines = []
@@ -55,69 +104,30 @@ class DiffParser:
                 in_hunk = False
                 old_line_num = 0
                 new_line_num = 0
-                continue
-            
-            # Extract file path
-            if line.startswith('---'):
-                match = re.search(r'^--- a/(.+)$', line)
-                if match:
-                    current_file_path = match.group(1)
-                current_diff_lines.append(line)
-                continue
-            
-            if line.startswith('+++'):
-                current_diff_lines.append(line)
-                continue
-            
-            # Hunk header
-            if line.startswith('@@'):
-                in_hunk = True
-                # Extract line numbers from hunk header: @@ -old_start,old_count +new_start,new_count @@
-                match = re.search(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@', line)
-                if match:
-                    old_line_num = int(match.group(1))
-                    new_line_num = int(match.group(3))
-                current_diff_lines.append(line)
-                continue
-            
-            if not in_hunk:
-                current_diff_lines.append(line)
-                continue
-            
-            # Code lines
-            if line.startswith('+') and not line.startswith('+++'):
-                # Added line
-                added_lines.append(new_line_num)
-                new_content_lines.append(line[1:])  # Remove '+' prefix
-                new_line_num += 1
-                current_diff_lines.append(line)
-            elif line.startswith('-') and not line.startswith('---'):
-                # Removed line
-                removed_lines.append(old_line_num)
-                old_content_lines.append(line[1:])  # Remove '-' prefix
-                old_line_num += 1
-                current_diff_lines.append(line)
-            elif line.startswith(' '):
-                # Context line (unchanged)
-                old_line_num += 1
-                new_line_num += 1
-                current_diff_lines.append(line)
-            else:
-                current_diff_lines.append(line)
         
         # Save last file
-        if current_file_path and current_diff_lines:
-            diffs.append(CodeDiff(
-                file_path=current_file_path,
-                old_content='\n'.join(old_content_lines) if old_content_lines else None,
-                new_content='\n'.join(new_content_lines) if new_content_lines else None,
-                added_lines=added_lines,
-                removed_lines=removed_lines,
-                diff_text='\n'.join(current_diff_lines)
+        if current_file_path:
+            diffs.append(DiffParser._build_diff(
+                current_file_path, old_content_lines, new_content_lines, added_lines, removed_lines,
+                diff_text[file_start:]
             ))
         
         return diffs
     
+    @staticmethod
+    def _build_diff(file_path: str, old_content_lines: List[str], new_content_lines: List[str],
+                    added_lines: List[int], removed_lines: List[int], diff_text: str) -> CodeDiff:
+        """Build a CodeDiff from the lines collected for one file"""
+        # The parser produces correctly typed fields, so skip validation
+        return CodeDiff.model_construct(
+            file_path=file_path,
+            old_content='\n'.join(old_content_lines) if old_content_lines else None,
+            new_content='\n'.join(new_content_lines) if new_content_lines else None,
+            added_lines=added_lines,
+            removed_lines=removed_lines,
+            diff_text=diff_text
+        )
+    
     @staticmethod
     def get_changed_lines(diff: CodeDiff) -> dict:
         """Extract changed lines with context"""
@@ -1,12 +1,35 @@
 """
 GitHub API client for fetching PR information and diffs
 """
+import asyncio
 import httpx
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 from models import CodeDiff
-from config import settings
+from config import HTTP2_AVAILABLE, settings
+from ttl_cache import TTLCache
 import base64
-from urllib.parse import quote
+import functools
+import hashlib
+import logging
+from urllib.parse import parse_qs, quote, urlsplit
+
+
+@functools.lru_cache(maxsize=1024)
+def _enc(name: str) -> str:
+    """URL-encode an owner or repo name; the same few names recur on every call"""
+    return quote(name.strip(), safe='')
+
+
+log = logging.getLogger("pr_review.github")
+
+# Largest page size GitHub allows when listing PR files
+FILES_PER_PAGE = 100
+
+
+# Parsed responses as (etag, value), shared by all clients; keys include a hash of the token,
+# so responses never leak across users. Fresh entries are served without a request; stale
+# ones are revalidated with If-None-Match, and a 304 doesn't count against the rate limit
+_response_cache = TTLCache(512, settings.github_cache_ttl)
 
 
 class GitHubClient:
@@ -17,113 +40,180 @@ class GitHubClient:
         self.base_url = settings.github_base_url
         self.headers = {
             "Accept": "application/vnd.github.v3+json",
-            "User-Agent": "Lyzr-PR-Review-Agent"
+            "User-Agent": "Lyzr-PR-Review-Agent",
+            # httpx decompresses transparently; no Connection header, since the pool
+            # keeps connections alive anyway and HTTP/2 forbids it
+            "Accept-Encoding": "gzip"
         }
         if self.token:
             self.headers["Authorization"] = f"token {self.token}"
+        # Pooled connection shared by every request (and by with_token clones),
+        # created on first use; headers are sent per request since clones differ
+        self._http: Optional[httpx.AsyncClient] = None
+        self._owns_http = True
+    
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """Shared HTTP client, created lazily"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                follow_redirects=True,
+                timeout=60.0,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        return self._http
+    
+    def with_token(self, token: str) -> "GitHubClient":
+        """Return a client authenticating with token that reuses this client's connections"""
+        client = GitHubClient(token=token)
+        client._http = self.http
+        client._owns_http = False
+        return client
+    
+    async def aclose(self):
+        """Close the connection pool (clones leave it to the client that created it)"""
+        if self._owns_http and self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
+    async def __aenter__(self) -> "GitHubClient":
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    
+    def _cache_key(self, url: str, headers: dict) -> str:
+        """Cache key for a request: URL, media type and (hashed) credentials"""
+        auth = hashlib.blake2b(headers.get("Authorization", "").encode(), digest_size=16).hexdigest()
+        return f"{url}|{headers.get('Accept', '')}|{auth}"
+    
+    async def _cached_get(self, url: str, headers: dict,
+                          parse: Callable[[httpx.Response], Awaitable[object]], stream: bool = False):
+        """
+        GET url through the response cache
+        
+        parse checks the response and returns its value; with stream=True the
+        body is left unread for parse to consume incrementally.
+        """
+        key = self._cache_key(url, headers)
+        entry = _response_cache.get_entry(key)
+        if entry is not None:
+            (etag, value), fresh = entry
+            if fresh:
+                return value
+            if etag:
+                headers = {**headers, "If-None-Match": etag}
+        
+        request = self.http.build_request("GET", url, headers=headers)
+        response = await self.http.send(request, stream=stream)
+        log.debug("GET %s -> %s (content-encoding: %s)", url, response.status_code,
+                  response.headers.get("content-encoding", "identity"))
+        try:
+            if response.status_code == 304 and entry is not None:
+                # Unchanged since we cached it
+                _response_cache.put(key, (etag, value))
+                return value
+            
+            value = await parse(response)
+        finally:
+            await response.aclose()
+        
+        _response_cache.put(key, (response.headers.get("ETag"), value))
+        return value
     
     async def get_pr_diff(self, owner: str, repo: str, pr_number: int) -> str:
         """Fetch the raw diff for a pull request"""
-        # URL encode owner and repo to handle special characters
-        owner_encoded = quote(owner.strip(), safe='')
-        repo_encoded = quote(repo.strip(), safe='')
-        
         # Use GitHub API to get diff directly with Accept header for diff format
-        url = f"{self.base_url}/repos/{owner_encoded}/{repo_encoded}/pulls/{pr_number}"
+        url = f"{self._repo_url(owner, repo)}/pulls/{pr_number}"
         
         # Headers for getting diff format
         diff_headers = self.headers.copy()
         diff_headers["Accept"] = "application/vnd.github.v3.diff"
         
-        async with httpx.AsyncClient(follow_redirects=True, timeout=60.0) as client:
-            # First verify PR exists
-            response = await client.get(url, headers=self.headers)
-            
-            if response.status_code == 404:
-                raise ValueError(
-                    f"PR #{pr_number} not found in repository '{owner}/{repo}'. "
-                    f"Please check that the repository exists and the PR number is correct."
-                )
-            elif response.status_code == 403:
-                raise ValueError(
-                    f"Access denied to repository '{owner}/{repo}'. "
-                    f"This might be a private repository. Please provide a GitHub token."
-                )
-            
-            response.raise_for_status()
-            
-            # Now fetch the diff with diff format header
-            diff_response = await client.get(url, headers=diff_headers)
-            
-            if diff_response.status_code == 404:
-                raise ValueError(
-                    f"PR #{pr_number} not found in repository '{owner}/{repo}'. "
-                    f"Please check that the repository exists and the PR number is correct."
-                )
-            elif diff_response.status_code == 403:
-                raise ValueError(
-                    f"Access denied to repository '{owner}/{repo}'. "
-                    f"This might be a private repository. Please provide a GitHub token."
-                )
-            
-            diff_response.raise_for_status()
-            return diff_response.text
+        # The diff endpoint reports a missing or private PR the same way the JSON one does,
+        # so there's no need to verify the PR exists first
+        async def parse(diff_response: httpx.Response) -> str:
+            self._check_pr_response(diff_response, owner, repo, pr_number)
+            # Collect the raw chunks and decode once, rather than buffering the
+            # response and then building a second full-size str from it
+            body = bytearray()
+            async for chunk in diff_response.aiter_bytes(65536):
+                body.extend(chunk)
+            return body.decode("utf-8", "replace")
+        
+        return await self._cached_get(url, diff_headers, parse, stream=True)
     
     async def get_pr_info(self, owner: str, repo: str, pr_number: int) -> dict:
         """Get PR metadata"""
-        # URL encode owner and repo to handle special characters
-        owner_encoded = quote(owner.strip(), safe='')
-        repo_encoded = quote(repo.strip(), safe='')
-        url = f"{self.base_url}/repos/{owner_encoded}/{repo_encoded}/pulls/{pr_number}"
+        url = f"{self._repo_url(owner, repo)}/pulls/{pr_number}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=self.headers)
-            
-            if response.status_code == 404:
-                raise ValueError(
-                    f"PR #{pr_number} not found in repository '{owner}/{repo}'. "
-                    f"Please check that the repository exists and the PR number is correct."
-                )
-            elif response.status_code == 403:
-                raise ValueError(
-                    f"Access denied to repository '{owner}/{repo}'. "
-                    f"This might be a private repository. Please provide a GitHub token."
-                )
-            
-            response.raise_for_status()
+        async def parse(response: httpx.Response) -> dict:
+            self._check_pr_response(response, owner, repo, pr_number)
             return response.json()
+        
+        return await self._cached_get(url, self.headers, parse)
+    
+    @staticmethod
+    def _check_pr_response(response: httpx.Response, owner: str, repo: str, pr_number: int):
+        """Raise a user-friendly ValueError for 404/403, or HTTPStatusError for other failures"""
+        if response.status_code == 404:
+            raise ValueError(
+                f"PR #{pr_number} not found in repository '{owner}/{repo}'. "
+                f"Please check that the repository exists and the PR number is correct."
+            )
+        elif response.status_code == 403:
+            raise ValueError(
+                f"Access denied to repository '{owner}/{repo}'. "
+                f"This might be a private repository. Please provide a GitHub token."
+            )
+        
+        response.raise_for_status()
+    
+    def _repo_url(self, owner: str, repo: str) -> str:
+        """REST URL of a repository, with owner and repo URL-encoded"""
+        return f"{self.base_url}/repos/{_enc(owner)}/{_enc(repo)}"
     
     async def get_pr_files(self, owner: str, repo: str, pr_number: int) -> List[dict]:
         """Get list of files changed in PR"""
-        # URL encode owner and repo to handle special characters
-        owner_encoded = quote(owner.strip(), safe='')
-        repo_encoded = quote(repo.strip(), safe='')
-        url = f"{self.base_url}/repos/{owner_encoded}/{repo_encoded}/pulls/{pr_number}/files"
+        url = f"{self._repo_url(owner, repo)}/pulls/{pr_number}/files?per_page={FILES_PER_PAGE}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=self.headers)
+        async def parse(response: httpx.Response) -> tuple:
             response.raise_for_status()
-            return response.json()
+            # The Link header of the first page names the last one
+            last_url = response.links.get("last", {}).get("url")
+            last_page = int(parse_qs(urlsplit(last_url).query).get("page", ["1"])[0]) if last_url else 1
+            return response.json(), last_page
+        
+        files, last_page = await self._cached_get(f"{url}&page=1", self.headers, parse)
+        if last_page <= 1:
+            return files
+        
+        # Fetch the remaining pages concurrently, a few at a time
+        sem = asyncio.Semaphore(10)
+        
+        async def get_page(page: int) -> List[dict]:
+            async with sem:
+                return (await self._cached_get(f"{url}&page={page}", self.headers, parse))[0]
+        
+        pages = await asyncio.gather(*(get_page(page) for page in range(2, last_page + 1)))
+        return files + [file for page in pages for file in page]
     
     async def get_file_content(self, owner: str, repo: str, path: str, ref: str = "main") -> Optional[str]:
         """Get file content from repository"""
-        # URL encode owner, repo, and path to handle special characters
-        owner_encoded = quote(owner.strip(), safe='')
-        repo_encoded = quote(repo.strip(), safe='')
+        # URL encode path to handle special characters
         path_encoded = quote(path, safe='/')
-        url = f"{self.base_url}/repos/{owner_encoded}/{repo_encoded}/contents/{path_encoded}"
+        url = f"{self._repo_url(owner, repo)}/contents/{path_encoded}"
         params = {"ref": ref}
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(url, headers=self.headers, params=params)
-                response.raise_for_status()
-                data = response.json()
-                
-                if data.get("encoding") == "base64":
-                    content = base64.b64decode(data["content"]).decode("utf-8")
-                    return content
-                return data.get("content")
-            except httpx.HTTPStatusError:
-                return None
-
+        try:
+            response = await self.http.get(url, headers=self.headers, params=params)
+            response.raise_for_status()
+            data = response.json()
+            
+            if data.get("encoding") == "base64":
+                content = base64.b64decode(data["content"]).decode("utf-8")
+                return content
+            return data.get("content")
+        except httpx.HTTPStatusError:
+            return None
@@ -3,9 +3,14 @@ FastAPI application for PR Review Agent
 """
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from collections import Counter
+from contextlib import asynccontextmanager
 from typing import List
 import asyncio
+import logging
 import httpx
+import orjson
 
 from models import (
     PRReviewRequest, 
@@ -17,13 +22,26 @@ from models import (
 )
 from github_client import GitHubClient
 from diff_parser import DiffParser
-from agents import MultiAgentReviewer
 from config import settings
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Close shared connections on shutdown"""
+    yield
+    await github_client.aclose()
+    if _reviewer is not None:
+        # Only loaded (and connected) once a review has run
+        from watsonx_llm import aclose_http_client
+        await aclose_http_client()
+
+
 app = FastAPI(
     title="Lyzr PR Review Agent",
     description="Automated GitHub Pull Request Review Agent with Multi-Agent Architecture",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # Serialize responses with orjson
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -35,10 +53,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+log = logging.getLogger("pr_review")
+
+# File types reviewed first when a PR has more files than we review
+# (tuples, so str.endswith can test them all in one C-level call)
+SOURCE_EXTENSIONS = ('.py', '.js', '.ts', '.tsx', '.jsx', '.java', '.cpp', '.c', '.go', '.rs')
+CONFIG_EXTENSIONS = ('.json', '.yaml', '.yml', '.toml', '.ini')
+
 # Initialize components
 github_client = GitHubClient()
 diff_parser = DiffParser()
-reviewer = MultiAgentReviewer()
+# Created on first review: importing agents pulls in the LangChain/LLM client stack,
+# which would otherwise slow down every startup and reload
+_reviewer = None
+_reviewer_lock = asyncio.Lock()
+
+
+def _create_reviewer():
+    """Import the agents module and build a MultiAgentReviewer"""
+    from agents import MultiAgentReviewer
+    return MultiAgentReviewer()
+
+
+async def _get_reviewer():
+    """Return the shared MultiAgentReviewer, creating it on first use"""
+    global _reviewer
+    if _reviewer is None:
+        async with _reviewer_lock:
+            if _reviewer is None:
+                # The import takes seconds, so run it off the event loop
+                # to keep other requests (e.g. health checks) responsive
+                _reviewer = await asyncio.to_thread(_create_reviewer)
+    return _reviewer
 
 
 @app.get("/")
@@ -50,6 +96,7 @@ async def root():
         "endpoints": {
             "review_pr": "/api/review/pr",
             "review_diff": "/api/review/diff",
+            "review_diff_stream": "/api/review/diff/stream",
             "health": "/health"
         }
     }
@@ -67,7 +114,16 @@ async def health():
     }
 
 
-@app.post("/api/review/pr", response_model=PRReviewResponse)
+# Lets clients probe liveness without a body; left out of the schema as a variant of GET /health
+@app.head("/health", include_in_schema=False)
+async def health_head():
+    """Liveness check endpoint"""
+    return Response(status_code=200)
+
+
+# Responses are built server-side from already-validated models, so they're dumped
+# directly instead of being revalidated against response_model; the schema is kept for the docs
+@app.post("/api/review/pr", response_model=None, responses={200: {"model": PRReviewResponse}})
 async def review_pr(request: PRReviewRequest):
     """
     Review a GitHub Pull Request
@@ -75,36 +131,38 @@ async def review_pr(request: PRReviewRequest):
     Fetches the PR diff from GitHub and runs multi-agent review
     """
     try:
-        # Use provided token or default
-        client = GitHubClient(token=request.github_token) if request.github_token else github_client
-        
-        # Fetch PR diff
-        diff_text = await client.get_pr_diff(
-            request.repo_owner,
-            request.repo_name,
-            request.pr_number
-        )
+        # Use provided token or default; either way requests share one connection pool
+        client = github_client.with_token(request.github_token) if request.github_token else github_client
         
-        # Get PR info for metadata
-        pr_info = await client.get_pr_info(
-            request.repo_owner,
-            request.repo_name,
-            request.pr_number
+        # Fetch PR diff and PR info for metadata concurrently; a failure in either
+        # surfaces as the ValueError/HTTPStatusError handled below
+        diff_text, pr_info = await asyncio.gather(
+            client.get_pr_diff(
+                request.repo_owner,
+                request.repo_name,
+                request.pr_number
+            ),
+            client.get_pr_info(
+                request.repo_owner,
+                request.repo_name,
+                request.pr_number
+            )
         )
         
-        # Parse diff
-        diffs = diff_parser.parse_diff(diff_text)
+        # Parse diff (a PR can come back with an empty diff, e.g. when nothing changed)
+        diffs = diff_parser.parse_diff(diff_text) if diff_text and not diff_text.isspace() else []
+        file_paths = [d.file_path for d in diffs]
         
         if not diffs:
-            return PRReviewResponse(
+            return ORJSONResponse(PRReviewResponse(
                 pr_number=request.pr_number,
                 repo=f"{request.repo_owner}/{request.repo_name}",
                 total_files_changed=0,
                 total_comments=0,
                 comments=[],
                 summary="No code changes found in PR",
-                review_metadata={"pr_title": pr_info.get("title", "")}
-            )
+                review_metadata={"pr_title": pr_info.get("title", ""), "files_changed": file_paths}
+            ).model_dump())
         
         # Limit number of files to review for faster response
         # Check if quick review mode is requested
@@ -114,20 +172,29 @@ async def review_pr(request: PRReviewRequest):
         MAX_FILES_TO_REVIEW = 3 if quick_mode else 5  # Even fewer files in quick mode
         if len(diffs) > MAX_FILES_TO_REVIEW:
             # Review most important files first (prioritize source code files)
-            source_files = [d for d in diffs if any(d.file_path.endswith(ext) for ext in ['.py', '.js', '.ts', '.tsx', '.jsx', '.java', '.cpp', '.c', '.go', '.rs', '.tsx'])]
-            config_files = [d for d in diffs if any(d.file_path.endswith(ext) for ext in ['.json', '.yaml', '.yml', '.toml', '.ini'])]
-            other_files = [d for d in diffs if d not in source_files and d not in config_files]
+            source_files, config_files, other_files = [], [], []
+            for d in diffs:
+                if d.file_path.endswith(SOURCE_EXTENSIONS):
+                    source_files.append(d)
+                    if len(source_files) == MAX_FILES_TO_REVIEW:
+                        # Enough source files; nothing else would make the cut
+                        break
+                elif d.file_path.endswith(CONFIG_EXTENSIONS):
+                    config_files.append(d)
+                else:
+                    other_files.append(d)
             # Prioritize: source code > config > others
             diffs_to_review = (source_files + config_files + other_files)[:MAX_FILES_TO_REVIEW]
         else:
             diffs_to_review = diffs
         
         # Run multi-agent review on limited files
+        reviewer = await _get_reviewer()
         all_comments = await reviewer.review_diffs(diffs_to_review, quick_mode=quick_mode)
         
         # Add note if files were limited
         if len(diffs) > MAX_FILES_TO_REVIEW:
-            all_comments.append(ReviewComment(
+            all_comments.append(ReviewComment.model_construct(
                 file_path="",
                 line_number=0,
                 category=ReviewCategory.READABILITY,
@@ -139,7 +206,7 @@ async def review_pr(request: PRReviewRequest):
         # Generate summary
         summary = _generate_summary(all_comments, pr_info)
         
-        return PRReviewResponse(
+        return ORJSONResponse(PRReviewResponse(
             pr_number=request.pr_number,
             repo=f"{request.repo_owner}/{request.repo_name}",
             total_files_changed=len(diffs),
@@ -150,9 +217,9 @@ async def review_pr(request: PRReviewRequest):
                 "pr_title": pr_info.get("title", ""),
                 "pr_author": pr_info.get("user", {}).get("login", ""),
                 "pr_state": pr_info.get("state", ""),
-                "files_changed": [d.file_path for d in diffs]
+                "files_changed": file_paths
             }
-        )
+        ).model_dump())
     
     except ValueError as e:
         # Handle user-friendly error messages from GitHub client
@@ -173,15 +240,12 @@ async def review_pr(request: PRReviewRequest):
         else:
             raise HTTPException(status_code=e.response.status_code, detail=f"GitHub API error: {str(e)}")
     except Exception as e:
-        import traceback
-        error_detail = str(e)
-        error_traceback = traceback.format_exc()
-        print(f"Error reviewing PR: {error_detail}")
-        print(f"Traceback: {error_traceback}")
-        raise HTTPException(status_code=500, detail=f"Error reviewing PR: {error_detail}")
+        # log.exception records the traceback too
+        log.exception("Error reviewing PR %s/%s#%d", request.repo_owner, request.repo_name, request.pr_number)
+        raise HTTPException(status_code=500, detail=f"Error reviewing PR: {str(e)}")
 
 
-@app.post("/api/review/diff", response_model=PRReviewResponse)
+@app.post("/api/review/diff", response_model=None, responses={200: {"model": PRReviewResponse}})
 async def review_diff(request: ManualDiffRequest):
     """
     Review a manual diff text
@@ -189,39 +253,85 @@ async def review_diff(request: ManualDiffRequest):
     Accepts raw diff text and runs multi-agent review
     """
     try:
+        # Nothing to parse or review; isspace() checks without copying like strip() would
+        if not request.diff_text or request.diff_text.isspace():
+            return ORJSONResponse(PRReviewResponse(
+                total_files_changed=0,
+                total_comments=0,
+                comments=[],
+                summary="No diff provided",
+                review_metadata={"source": "manual_diff"}
+            ).model_dump())
+        
         # Parse diff
         diffs = diff_parser.parse_diff(request.diff_text)
+        file_paths = [d.file_path for d in diffs]
         
         if not diffs:
-            return PRReviewResponse(
+            return ORJSONResponse(PRReviewResponse(
                 total_files_changed=0,
                 total_comments=0,
                 comments=[],
                 summary="No code changes found in diff",
-                review_metadata={}
-            )
+                review_metadata={"files_changed": file_paths, "source": "manual_diff"}
+            ).model_dump())
         
         # Run multi-agent review
+        reviewer = await _get_reviewer()
         all_comments = await reviewer.review_diffs(diffs)
         
         # Generate summary
         summary = _generate_summary(all_comments, {})
         
-        return PRReviewResponse(
+        return ORJSONResponse(PRReviewResponse(
             total_files_changed=len(diffs),
             total_comments=len(all_comments),
             comments=all_comments,
             summary=summary,
             review_metadata={
-                "files_changed": [d.file_path for d in diffs],
+                "files_changed": file_paths,
                 "source": "manual_diff"
             }
-        )
+        ).model_dump())
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reviewing diff: {str(e)}")
 
 
+@app.post("/api/review/diff/stream")
+async def review_diff_stream(request: ManualDiffRequest):
+    """
+    Review a manual diff text, streaming comments as they are produced
+    
+    Responds with newline-delimited JSON, one ReviewComment per line, in the
+    order the agents finish, then a final {"done": true, ...} line with the
+    same totals, summary and metadata as /api/review/diff
+    """
+    try:
+        diffs = diff_parser.parse_diff(request.diff_text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reviewing diff: {str(e)}")
+    
+    reviewer = await _get_reviewer()
+    
+    async def comment_lines():
+        comments = []
+        async for comment in reviewer.review_diffs_stream(diffs):
+            comments.append(comment)
+            yield comment.model_dump_json() + "\n"
+        
+        summary = _generate_summary(comments, {}) if diffs else "No code changes found in diff"
+        yield orjson.dumps({
+            "done": True,
+            "total_files_changed": len(diffs),
+            "total_comments": len(comments),
+            "summary": summary,
+            "review_metadata": {"files_changed": [d.file_path for d in diffs], "source": "manual_diff"}
+        }) + b"\n"
+    
+    return StreamingResponse(comment_lines(), media_type="application/x-ndjson")
+
+
 @app.get("/api/review/stats")
 async def get_review_stats():
     """Get review statistics"""
@@ -249,17 +359,18 @@ def _generate_summary(comments: List[ReviewComment], pr_info: dict) -> str:
     if not comments:
         return "✅ No issues found. Code looks good!"
     
-    # Count by category
-    by_category = {}
-    by_severity = {"critical": 0, "major": 0, "minor": 0, "suggestion": 0}
+    # Count by category, severity and file in one pass
+    by_category = Counter()
+    by_severity = Counter()
+    files = set()
     
     for comment in comments:
-        cat = comment.category.value
-        by_category[cat] = by_category.get(cat, 0) + 1
-        by_severity[comment.severity] = by_severity.get(comment.severity, 0) + 1
+        by_category[comment.category] += 1
+        by_severity[comment.severity] += 1
+        files.add(comment.file_path)
     
     summary_parts = [
-        f"Found {len(comments)} review comment(s) across {len(set(c.file_path for c in comments))} file(s)."
+        f"Found {len(comments)} review comment(s) across {len(files)} file(s)."
     ]
     
     if by_severity["critical"] > 0:
@@ -269,8 +380,8 @@ def _generate_summary(comments: List[ReviewComment], pr_info: dict) -> str:
     
     if by_category:
         summary_parts.append("\nIssues by category:")
-        for cat, count in sorted(by_category.items(), key=lambda x: x[1], reverse=True):
-            summary_parts.append(f"  - {cat}: {count}")
+        for cat, count in by_category.most_common():
+            summary_parts.append(f"  - {cat.value}: {count}")
     
     return "\n".join(summary_parts)
 
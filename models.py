@@ -5,6 +5,15 @@ from pydantic import BaseModel, Field
 from typing import List, Optional, Literal
 from enum import Enum
 
+__all__ = [
+    "ReviewCategory",
+    "ReviewComment",
+    "CodeDiff",
+    "PRReviewRequest",
+    "ManualDiffRequest",
+    "PRReviewResponse",
+]
+
 
 class ReviewCategory(str, Enum):
     """Categories of code review issues"""
@@ -3,11 +3,26 @@ OpenRouter LLM integration for LangChain
 Supports DeepSeek and other models via OpenRouter API
 """
 from typing import List, Optional, Any
+import functools
 from langchain_openai import ChatOpenAI
 from langchain.schema import BaseMessage, HumanMessage, SystemMessage
 from pydantic import Field
 
 
+@functools.lru_cache(maxsize=8)
+def _make_chat_model(model_id: str, temperature: float, max_tokens: int, api_key: str) -> ChatOpenAI:
+    """Create the OpenAI-compatible client once per configuration, so its connection pool is reused"""
+    # OpenRouter uses OpenAI-compatible API with custom base URL
+    # The api_key parameter will be used for Authorization header automatically
+    return ChatOpenAI(
+        model=model_id,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        openai_api_key=api_key,
+        openai_api_base="https://openrouter.ai/api/v1"
+    )
+
+
 class OpenRouterChat:
     """Chat interface for OpenRouter that mimics LangChain's ChatOpenAI interface"""
     
@@ -25,15 +40,7 @@ class OpenRouterChat:
         # Format model name correctly (remove :free suffix if present)
         clean_model_id = model_id.replace(":free", "") if ":free" in model_id else model_id
         
-        # OpenRouter uses OpenAI-compatible API with custom base URL
-        # The api_key parameter will be used for Authorization header automatically
-        self.llm = ChatOpenAI(
-            model=clean_model_id,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            openai_api_key=api_key,
-            openai_api_base="https://openrouter.ai/api/v1"
-        )
+        self.llm = _make_chat_model(clean_model_id, temperature, max_tokens, api_key)
         
         # Store API key for reference
         self.api_key = api_key
@@ -56,5 +63,5 @@ class OpenRouterChat:
                 return Response(str(response))
         except Exception as e:
             # Re-raise with more context
-            raise Exception(f"OpenRouter API error: {str(e)}")
+            raise Exception(f"OpenRouter API error: {str(e)}") from e
 
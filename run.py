@@ -1,10 +1,14 @@
 """
 Quick start script for the PR Review Agent
 """
+import logging
 import uvicorn
 import os
 from config import settings
 
+# At module level so it also applies in the processes uvicorn spawns for reload/workers
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 if __name__ == "__main__":
     print("=" * 60)
     print("Lyzr PR Review Agent")
@@ -28,10 +32,16 @@ if __name__ == "__main__":
     
     print("Starting server...\n")
     
+    # Auto-reload in development; in production run several worker processes.
+    # uvicorn[standard] already picks uvloop and httptools when they're available
+    workers = int(os.getenv("UVICORN_WORKERS", "1"))
+    reload = os.getenv("ENV", "dev") == "dev" and workers == 1
+    
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True
+        reload=reload,
+        workers=workers
     )
 
@@ -16,8 +16,14 @@ def main():
     print("Run 'python run.py' in another terminal to start the backend.\n")
     print("=" * 60)
     
-    # Run streamlit
-    subprocess.run([sys.executable, "-m", "streamlit", "run", "streamlit_app.py"])
+    command = [sys.executable, "-m", "streamlit", "run", "streamlit_app.py"]
+    if os.name == "nt":
+        # execv on Windows spawns a new process and exits, detaching Streamlit from Ctrl+C
+        subprocess.run(command)
+    else:
+        # Replace this process with streamlit, so signals (Ctrl+C) go straight to it
+        sys.stdout.flush()
+        os.execv(sys.executable, command)
 
 if __name__ == "__main__":
     main()
@@ -3,9 +3,12 @@ Streamlit Frontend for Lyzr PR Review Agent
 """
 import streamlit as st
 import httpx
-import json
+import heapq
+import orjson
+from collections import Counter, defaultdict
 from typing import List, Dict
 import time
+import uuid
 
 # Page configuration
 st.set_page_config(
@@ -16,7 +19,7 @@ st.set_page_config(
 )
 
 # Custom CSS for better styling
-st.markdown("""
+CUSTOM_CSS = """
     <style>
     .main-header {
         font-size: 2.5rem;
@@ -78,22 +81,64 @@ st.markdown("""
         text-align: center;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
 
 # API Configuration
 API_BASE_URL = "http://localhost:8000"
 
-def check_api_health():
-    """Check if the API server is running"""
+# Request bodies are encoded with orjson and sent as raw content
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Severity badge color
+SEVERITY_EMOJIS = {
+    "critical": "🔴",
+    "major": "🟠",
+    "minor": "🟡",
+    "suggestion": "🟢"
+}
+
+# Category emoji
+CATEGORY_EMOJIS = {
+    "logic": "🧠",
+    "readability": "📖",
+    "performance": "⚡",
+    "security": "🔒",
+    "best_practices": "✨",
+    "testing": "🧪"
+}
+
+@st.cache_resource
+def get_api_client() -> httpx.Client:
+    """HTTP client shared across reruns and sessions, so connections to the API are reused"""
+    return httpx.Client(
+        timeout=600.0,  # Reviews can take several minutes
+        limits=httpx.Limits(max_keepalive_connections=10)
+    )
+
+@st.cache_data(ttl=30, show_spinner=False)
+def check_api_health() -> bool:
+    """
+    Check if the API server is running (cached for 30s, since every rerun asks)
+    
+    Uses a body-less HEAD request with a short timeout, so a down API delays the sidebar by at most 0.5s.
+    """
     try:
-        response = httpx.get(f"{API_BASE_URL}/health", timeout=5.0)
-        if response.status_code == 200:
-            return True, response.json()
-        return False, None
+        response = get_api_client().head(f"{API_BASE_URL}/health", timeout=0.5)
+        return response.is_success
     except httpx.ConnectError:
-        return False, None
+        return False
     except Exception:
-        return False, None
+        return False
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_health_details():
+    """Fetch the provider/model details from the health endpoint, only when the user asks for them"""
+    try:
+        response = get_api_client().get(f"{API_BASE_URL}/health", timeout=5.0)
+        response.raise_for_status()
+        return response.json()
+    except Exception:
+        return None
 
 def review_pr(repo_owner: str, repo_name: str, pr_number: int, github_token: str = None, quick_review: bool = True):
     """Call the PR review API"""
@@ -110,18 +155,17 @@ def review_pr(repo_owner: str, repo_name: str, pr_number: int, github_token: str
             "repo_owner": repo_owner,
             "repo_name": repo_name,
             "pr_number": pr_number,
-            "quick_review": quick_review
+            "quick_review": quick_review,
+            **({"github_token": github_token} if github_token else {})
         }
-        if github_token:
-            payload["github_token"] = github_token
         
-        with httpx.Client(timeout=600.0) as client:  # Increased to 10 minutes
-            response = client.post(
-                f"{API_BASE_URL}/api/review/pr",
-                json=payload
-            )
-            response.raise_for_status()
-            return response.json()
+        response = get_api_client().post(
+            f"{API_BASE_URL}/api/review/pr",
+            content=orjson.dumps(payload),
+            headers=JSON_HEADERS
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     except httpx.HTTPStatusError as e:
         error_text = e.response.text
         try:
@@ -152,17 +196,15 @@ def review_pr(repo_owner: str, repo_name: str, pr_number: int, github_token: str
 def review_diff(diff_text: str, file_path: str = None):
     """Call the diff review API"""
     try:
-        payload = {"diff_text": diff_text}
-        if file_path:
-            payload["file_path"] = file_path
+        payload = {"diff_text": diff_text, **({"file_path": file_path} if file_path else {})}
         
-        with httpx.Client(timeout=600.0) as client:  # Increased to 10 minutes
-            response = client.post(
-                f"{API_BASE_URL}/api/review/diff",
-                json=payload
-            )
-            response.raise_for_status()
-            return response.json()
+        response = get_api_client().post(
+            f"{API_BASE_URL}/api/review/diff",
+            content=orjson.dumps(payload),
+            headers=JSON_HEADERS
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     except httpx.HTTPStatusError as e:
         st.error(f"API Error: {e.response.status_code} - {e.response.text}")
         return None
@@ -170,7 +212,61 @@ def review_diff(diff_text: str, file_path: str = None):
         st.error(f"Error: {str(e)}")
         return None
 
-def display_review_results(review_data: Dict):
+def review_diff_stream(diff_text: str, file_path: str = None):
+    """
+    Call the streaming diff review API, yielding each comment as the agents produce it
+    
+    The last item is the {"done": true, ...} line with the review's totals and summary.
+    """
+    payload = {"diff_text": diff_text, **({"file_path": file_path} if file_path else {})}
+    
+    with get_api_client().stream(
+        "POST",
+        f"{API_BASE_URL}/api/review/diff/stream",
+        content=orjson.dumps(payload),
+        headers=JSON_HEADERS
+    ) as response:
+        if response.is_error:
+            response.read()
+            response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield orjson.loads(line)
+
+def store_review(state_key: str, review_data: Dict):
+    """Keep a review in session state under a fresh id, so it survives reruns from filter changes"""
+    st.session_state[state_key] = {"review_id": uuid.uuid4().hex, "data": review_data}
+
+# The cached helpers below are keyed by review_id; the leading underscore on
+# _comments/_buckets tells Streamlit not to hash those (potentially large) arguments
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def bucket_comments(review_id: str, _comments: List[Dict]):
+    """
+    Group comment indices by (severity, category) and count severities, in one pass
+    
+    Index lists stay in ascending order, so merging buckets preserves the API's ordering.
+    """
+    buckets = defaultdict(list)
+    severity_counts = Counter()
+    for index, comment in enumerate(_comments):
+        severity = comment.get("severity")
+        buckets[(severity, comment.get("category"))].append(index)
+        severity_counts[severity] += 1
+    return buckets, severity_counts
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def filter_comment_indices(review_id: str, _buckets: Dict, severities: tuple, categories: tuple) -> List[int]:
+    """Indices of the comments matching the filters, merged back into their original order"""
+    selected = [
+        _buckets[(severity, category)]
+        for severity in severities
+        for category in categories
+        if (severity, category) in _buckets
+    ]
+    return list(heapq.merge(*selected))
+
+def display_review_results(review_data: Dict, review_id: str, key_prefix: str = ""):
     """Display review results in a nice format"""
     if not review_data:
         return
@@ -186,8 +282,9 @@ def display_review_results(review_data: Dict):
     
     # Count by severity
     comments = review_data.get("comments", [])
-    critical_count = sum(1 for c in comments if c.get("severity") == "critical")
-    major_count = sum(1 for c in comments if c.get("severity") == "major")
+    buckets, severity_counts = bucket_comments(review_id, comments)
+    critical_count = severity_counts["critical"]
+    major_count = severity_counts["major"]
     
     with col3:
         st.metric("Critical Issues", critical_count, delta=None, delta_color="inverse")
@@ -209,20 +306,21 @@ def display_review_results(review_data: Dict):
             severity_filter = st.multiselect(
                 "Filter by Severity",
                 ["critical", "major", "minor", "suggestion"],
-                default=["critical", "major", "minor", "suggestion"]
+                default=["critical", "major", "minor", "suggestion"],
+                key=f"{key_prefix}_severity_filter"
             )
         with col2:
             category_filter = st.multiselect(
                 "Filter by Category",
                 ["logic", "readability", "performance", "security", "best_practices", "testing"],
-                default=["logic", "readability", "performance", "security", "best_practices", "testing"]
+                default=["logic", "readability", "performance", "security", "best_practices", "testing"],
+                key=f"{key_prefix}_category_filter"
             )
         
-        # Filter comments
+        # Filter comments; sorted tuples make the cache key independent of selection order
         filtered_comments = [
-            c for c in comments
-            if c.get("severity") in severity_filter
-            and c.get("category") in category_filter
+            comments[i]
+            for i in filter_comment_indices(review_id, buckets, tuple(sorted(severity_filter)), tuple(sorted(category_filter)))
         ]
         
         if not filtered_comments:
@@ -231,33 +329,11 @@ def display_review_results(review_data: Dict):
             for comment in filtered_comments:
                 severity = comment.get("severity", "suggestion")
                 category = comment.get("category", "general")
-                
-                # Severity badge color
-                severity_colors = {
-                    "critical": "🔴",
-                    "major": "🟠",
-                    "minor": "🟡",
-                    "suggestion": "🟢"
-                }
-                
-                # Category emoji
-                category_emojis = {
-                    "logic": "🧠",
-                    "readability": "📖",
-                    "performance": "⚡",
-                    "security": "🔒",
-                    "best_practices": "✨",
-                    "testing": "🧪"
-                }
-                
-                emoji = severity_colors.get(severity, "🟢")
-                cat_emoji = category_emojis.get(category, "📝")
+                severity_emoji = SEVERITY_EMOJIS.get(severity, "🟢")
+                cat_emoji = CATEGORY_EMOJIS.get(category, "📝")
                 
                 with st.container():
                     # Use Streamlit's native components for better visibility
-                    severity_emoji = severity_colors.get(severity, "🟢")
-                    cat_emoji = category_emojis.get(category, "📝")
-                    
                     # Create expandable section for each comment
                     with st.expander(f"{severity_emoji} {cat_emoji} **{comment.get('title', 'Review Comment')}** - {severity.upper()}", expanded=(severity in ["critical", "major"])):
                         st.markdown(f"""
@@ -281,8 +357,19 @@ def display_review_results(review_data: Dict):
     else:
         st.success("✅ No issues found! Code looks good.")
 
+def inject_css():
+    """
+    Emit the custom stylesheet
+    
+    Called on every run: Streamlit drops elements a rerun doesn't re-send, so caching this
+    call would lose the styles after the first interaction.
+    """
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
 def main():
     """Main Streamlit app"""
+    inject_css()
+    
     # Header
     st.markdown('<h1 class="main-header">🤖 Lyzr PR Review Agent</h1>', unsafe_allow_html=True)
     st.markdown("---")
@@ -293,10 +380,15 @@ def main():
         
         # API Health Check
         st.subheader("API Status")
-        api_healthy, health_data = check_api_health()
+        if st.button("🔄 Refresh status"):
+            # Drop the cached results so the API is probed again
+            check_api_health.clear()
+            get_health_details.clear()
+        api_healthy = check_api_health()
         
         if api_healthy:
             st.success("✅ API Connected")
+            health_data = get_health_details() if st.checkbox("Show provider details", key="show_health_details") else None
             if health_data:
                 provider = health_data.get('llm_provider', 'N/A')
                 model = health_data.get('model', 'N/A')
@@ -399,11 +491,16 @@ PR Number: 1
                         progress_bar.progress(100)
                         status_text.success("✅ Review completed!")
                         st.success("✅ Review completed!")
-                        display_review_results(review_data)
+                        store_review("pr_review", review_data)
                 except Exception as e:
                     progress_bar.progress(0)
                     status_text.error(f"❌ Error: {str(e)}")
                     raise
+        
+        # Shown outside the button branch, so the results stay up when filters change
+        pr_review = st.session_state.get("pr_review")
+        if pr_review:
+            display_review_results(pr_review["data"], pr_review["review_id"], key_prefix="pr")
     
     with tab2:
         st.header("Review Manual Diff")
@@ -432,9 +529,45 @@ index 1234567..abcdefg 100644
 """
         )
         
+        stream_results = st.checkbox(
+            "📡 Stream results",
+            value=False,
+            help="Show comments as each agent finishes instead of waiting for the full review"
+        )
+        
         if st.button("🚀 Review Diff", type="primary", use_container_width=True):
             if not diff_text.strip():
                 st.error("Please provide a diff to review")
+            elif stream_results:
+                status_text = st.empty()
+                status_text.info("🔄 Streaming comments from AI agents...")
+                live_comments = st.empty()
+                
+                comments = []
+                review_data = None
+                try:
+                    for item in review_diff_stream(diff_text, file_path if file_path else None):
+                        if item.get("done"):
+                            # The final line carries the server's totals and summary
+                            review_data = {**item, "comments": comments}
+                            break
+                        comments.append(item)
+                        live_comments.markdown("\n".join(
+                            f"- **{c.get('title', 'Review Comment')}** ({c.get('severity', 'suggestion')}) `{c.get('file_path', 'N/A')}`"
+                            for c in comments
+                        ))
+                except httpx.HTTPStatusError as e:
+                    status_text.error(f"API Error: {e.response.status_code} - {e.response.text}")
+                except Exception as e:
+                    status_text.error(f"❌ Error: {str(e)}")
+                else:
+                    if review_data is None:
+                        status_text.error("❌ Error: the review stream ended before the review finished")
+                    else:
+                        # Replace the live list with the full results view
+                        live_comments.empty()
+                        status_text.success("✅ Review completed!")
+                        store_review("diff_review", review_data)
             else:
                 # Create progress container
                 progress_container = st.container()
@@ -451,11 +584,15 @@ index 1234567..abcdefg 100644
                         progress_bar.progress(100)
                         status_text.success("✅ Review completed!")
                         st.success("✅ Review completed!")
-                        display_review_results(review_data)
+                        store_review("diff_review", review_data)
                 except Exception as e:
                     progress_bar.progress(0)
                     status_text.error(f"❌ Error: {str(e)}")
                     raise
+        
+        diff_review = st.session_state.get("diff_review")
+        if diff_review:
+            display_review_results(diff_review["data"], diff_review["review_id"], key_prefix="diff")
     
     # Footer
     st.markdown("---")
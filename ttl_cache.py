@@ -0,0 +1,60 @@
+"""
+Small LRU cache with per-entry expiry, shared by the review and GitHub response caches
+"""
+from typing import Any, Hashable, Optional, Tuple
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    LRU cache whose entries expire ttl seconds after they are stored
+    
+    A ttl of 0 or less disables the cache: puts are ignored and gets miss.
+    Expired entries stay until evicted, so callers that can revalidate them
+    (e.g. with an ETag) can still read them through get_entry. All access holds
+    a lock, so the cache can be shared across threads.
+    """
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+    
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for key if present and fresh, else None"""
+        entry = self.get_entry(key)
+        if entry is None or not entry[1]:
+            return None
+        return entry[0]
+    
+    def get_entry(self, key: Hashable) -> Optional[Tuple[Any, bool]]:
+        """Return (value, is_fresh) for key, including expired entries, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        expires_at, value = entry
+        return value, time.monotonic() < expires_at
+    
+    def put(self, key: Hashable, value: Any):
+        """Store value under key, evicting the least recently used entries"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -6,15 +6,69 @@ from langchain.schema import BaseMessage, HumanMessage, SystemMessage
 from langchain.callbacks.manager import CallbackManagerForLLMRun
 from langchain.llms.base import BaseLLM
 from langchain.schema import Generation, LLMResult
+from langchain.pydantic_v1 import PrivateAttr
 from pydantic import Field
+import asyncio
+import hashlib
 import httpx
-import json
-from config import settings
+import orjson
+import threading
+import time
+import weakref
+from config import HTTP2_AVAILABLE, settings
 
 
-# Class-level cache for IAM tokens (shared across instances)
-_iam_token_cache: dict = {}
-_iam_token_expiry: dict = {}
+# Process-wide cache of IAM tokens as (token, expires_at), keyed by a hash of the API key
+_iam_token_cache: "dict[bytes, tuple]" = {}
+# One lock per event loop, so concurrent first calls wait for a single token fetch
+_iam_token_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+# Tasks for generation requests in progress, per event loop and keyed by a hash of the
+# prompt and generation settings. Finished results aren't kept here: reviews are
+# cached per agent in agents.py, which honors REVIEW_CACHE_TTL/REVIEW_CACHE_SIZE
+_inflight_requests: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+# Connection pools shared by all IAM and generation requests, one per event loop.
+# A client can only be used on the loop it was created on (the sync entry points
+# use a background loop, async callers their own), so each loop keeps its own
+_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=60.0,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        )
+        _http_clients[loop] = client
+    return client
+
+
+async def aclose_http_client():
+    """Close the running event loop's HTTP client; other loops' clients are left alone"""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+# Event loop for the synchronous entry points, run forever in a daemon thread, so sync
+# calls share one loop (and its HTTP client) instead of each creating and tearing down one
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_loop_lock = threading.Lock()
+
+
+def _run_sync(coro):
+    """Run a coroutine on the background event loop and wait for its result"""
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="watsonx-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop).result()
+
 
 class WatsonxLLM(BaseLLM):
     """IBM Watsonx LLM wrapper for LangChain"""
@@ -26,10 +80,73 @@ class WatsonxLLM(BaseLLM):
     temperature: float = Field(default=0.5)
     max_tokens: int = Field(default=300)
     
+    # Validated settings and endpoints, derived once from the fields in __init__
+    _api_key: str = PrivateAttr(default="")
+    _project_id: str = PrivateAttr(default="")
+    _model_id: str = PrivateAttr(default="")
+    _base_url: str = PrivateAttr(default="")
+    _endpoint: str = PrivateAttr(default="")
+    _payload_template: dict = PrivateAttr(default_factory=dict)
+    
     class Config:
         arbitrary_types_allowed = True
         populate_by_name = True  # Allow both alias and field name
     
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        
+        # Validate required fields
+        url_value = (self.watsonx_url or "").strip()
+        self._api_key = (self.watsonx_api_key or "").strip()
+        self._project_id = (self.watsonx_project_id or "").strip()
+        self._model_id = (self.model_id or "").strip()
+        if not url_value:
+            raise ValueError("Watsonx URL is not configured. Please set WATSONX_URL in your .env file.")
+        if not self._api_key:
+            raise ValueError("Watsonx API key is not configured. Please set WATSONX_API_KEY in your .env file.")
+        if not self._project_id:
+            raise ValueError("Watsonx Project ID is not configured. Please set WATSONX_PROJECT_ID in your .env file.")
+        if not self._model_id:
+            raise ValueError("Watsonx Model ID is not configured. Please set MODEL_NAME in your .env file.")
+        
+        # Check if API key looks valid (should have some length)
+        if len(self._api_key) < 10:
+            raise ValueError(f"Invalid API key format. API key appears to be empty or too short.")
+        
+        self._base_url = f"https://{self._normalize_url(url_value)}"
+        self._endpoint = f"{self._base_url}/ml/v1/text/generation?version=2023-05-29"
+        
+        # Request body for the generation endpoint, minus the per-call "input";
+        # it's only ever serialized, so calls can share its nested dicts
+        self._payload_template = {
+            "parameters": {
+                "decoding_method": "greedy",
+                "max_new_tokens": self.max_tokens,
+                "temperature": self.temperature,
+                "top_p": 0.9,
+                "repetition_penalty": 1.1,
+                "stop_sequences": []
+            },
+            "model_id": self._model_id,
+            "project_id": self._project_id
+        }
+    
+    @staticmethod
+    def _normalize_url(url_value: str) -> str:
+        """Reduce the configured URL to a bare hostname, rejecting values that can't be one"""
+        base_url = url_value.rstrip('/')
+        # Remove http:// or https:// if present, we'll add https://
+        base_url = base_url.replace('http://', '').replace('https://', '')
+        
+        if not base_url:
+            raise ValueError("Watsonx URL is empty. Please set WATSONX_URL in your .env file (e.g., us-south.ml.cloud.ibm.com)")
+        
+        # Ensure we have a valid hostname
+        if '.' not in base_url:
+            raise ValueError(f"Invalid Watsonx URL format: {base_url}. Expected format: us-south.ml.cloud.ibm.com")
+        
+        return base_url
+    
     @property
     def _llm_type(self) -> str:
         return "watsonx"
@@ -42,14 +159,12 @@ class WatsonxLLM(BaseLLM):
         **kwargs: Any,
     ) -> LLMResult:
         """Generate text from prompts - required by BaseLLM"""
-        import asyncio
-        generations = []
-        
-        for prompt in prompts:
-            text = asyncio.run(self._acall(prompt, stop, run_manager, **kwargs))
-            generations.append([Generation(text=text)])
+        # Run all prompts concurrently on the background loop; gather keeps their order
+        async def generate_all() -> List[str]:
+            return await asyncio.gather(*(self._acall(prompt, stop, run_manager, **kwargs) for prompt in prompts))
         
-        return LLMResult(generations=generations)
+        texts = _run_sync(generate_all())
+        return LLMResult(generations=[[Generation(text=text)] for text in texts])
     
     def _call(
         self,
@@ -59,23 +174,31 @@ class WatsonxLLM(BaseLLM):
         **kwargs: Any,
     ) -> str:
         """Synchronous call to Watsonx API"""
-        import asyncio
-        return asyncio.run(self._acall(prompt, stop, run_manager, **kwargs))
+        return _run_sync(self._acall(prompt, stop, run_manager, **kwargs))
     
     async def _get_iam_token(self, api_key: str) -> str:
         """Get IAM access token from IBM using API key (with caching)"""
-        import time
-        
-        # Use class-level cache with API key as key
-        cache_key = api_key[:20]  # Use first 20 chars as cache key
+        # Hash the whole key, so keys sharing a prefix never share a token
+        cache_key = hashlib.blake2b(api_key.encode(), digest_size=16).digest()
         
         # Check cache - IAM tokens typically expire in 1 hour, cache for 50 minutes
-        current_time = time.time()
-        if (cache_key in _iam_token_cache and 
-            cache_key in _iam_token_expiry and 
-            current_time < _iam_token_expiry[cache_key]):
-            return _iam_token_cache[cache_key]
+        cached = _iam_token_cache.get(cache_key)
+        if cached is not None and time.time() < cached[1]:
+            return cached[0]
         
+        loop = asyncio.get_running_loop()
+        lock = _iam_token_locks.get(loop)
+        if lock is None:
+            lock = _iam_token_locks[loop] = asyncio.Lock()
+        async with lock:
+            # Another call may have fetched the token while this one waited
+            cached = _iam_token_cache.get(cache_key)
+            if cached is not None and time.time() < cached[1]:
+                return cached[0]
+            return await self._fetch_iam_token(api_key, cache_key)
+    
+    async def _fetch_iam_token(self, api_key: str, cache_key: bytes) -> str:
+        """Request a new IAM access token and store it in the cache"""
         # Get new token
         iam_url = "https://iam.cloud.ibm.com/identity/token"
         iam_payload = {
@@ -84,28 +207,34 @@ class WatsonxLLM(BaseLLM):
         }
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    iam_url,
-                    headers={"Content-Type": "application/x-www-form-urlencoded"},
-                    data=iam_payload
-                )
-                response.raise_for_status()
-                token_data = response.json()
-                access_token = token_data.get("access_token")
-                if not access_token:
-                    raise ValueError("No access token received from IAM service")
-                
-                # Cache the token (expires in ~1 hour, cache for 50 minutes)
-                _iam_token_cache[cache_key] = access_token
-                _iam_token_expiry[cache_key] = current_time + (50 * 60)  # 50 minutes
-                
-                return access_token
+            response = await _get_http_client().post(
+                iam_url,
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                data=iam_payload,
+                timeout=30.0
+            )
+            response.raise_for_status()
+            token_data = response.json()
+            access_token = token_data.get("access_token")
+            if not access_token:
+                raise ValueError("No access token received from IAM service")
+            
+            # Cache the token (expires in ~1 hour, cache for 50 minutes)
+            _iam_token_cache[cache_key] = (access_token, time.time() + (50 * 60))
+            
+            return access_token
         except httpx.HTTPStatusError as e:
             raise Exception(f"Failed to get IAM token: {e.response.status_code} - {e.response.text}")
         except Exception as e:
             raise Exception(f"Error getting IAM token: {str(e)}")
     
+    def _request_key(self, prompt: str) -> bytes:
+        """Key for coalescing identical requests: a hash of the prompt and generation settings"""
+        return hashlib.blake2b(
+            f"{self._model_id}|{self._project_id}|{self.temperature}|{self.max_tokens}|{prompt}".encode(),
+            digest_size=16
+        ).digest()
+    
     async def _acall(
         self,
         prompt: str,
@@ -114,65 +243,36 @@ class WatsonxLLM(BaseLLM):
         **kwargs: Any,
     ) -> str:
         """Asynchronous call to Watsonx API"""
-        # Get values from Pydantic model - access by field name directly
-        try:
-            # Direct attribute access - Pydantic should populate these
-            url_value = getattr(self, 'watsonx_url', '') or getattr(self, 'url', '')
-            api_key_val = getattr(self, 'watsonx_api_key', '') or getattr(self, 'api_key', '')
-            project_id_val = getattr(self, 'watsonx_project_id', '') or getattr(self, 'project_id', '')
-            model_id_val = getattr(self, 'model_id', '')
-            
-            # If direct access didn't work, try model_dump
-            if not url_value or not isinstance(url_value, str):
-                if hasattr(self, 'model_dump'):
-                    model_data = self.model_dump(by_alias=False)  # Get by field name
-                    url_value = model_data.get('watsonx_url', '')
-                    api_key_val = model_data.get('watsonx_api_key', '')
-                    project_id_val = model_data.get('watsonx_project_id', '')
-                    model_id_val = model_data.get('model_id', '')
-        except Exception as e:
-            # Ultimate fallback
-            print(f"Warning: Error getting model values: {e}")
-            url_value = ''
-            api_key_val = ''
-            project_id_val = ''
-            model_id_val = ''
-        
-        # Ensure we have string values
-        url_value = str(url_value).strip() if url_value else ''
-        api_key_val = str(api_key_val).strip() if api_key_val else ''
-        project_id_val = str(project_id_val).strip() if project_id_val else ''
-        model_id_val = str(model_id_val).strip() if model_id_val else ''
-        
-        # Validate required fields
-        if not url_value:
-            raise ValueError("Watsonx URL is not configured. Please set WATSONX_URL in your .env file.")
-        if not api_key_val:
-            raise ValueError("Watsonx API key is not configured. Please set WATSONX_API_KEY in your .env file.")
-        if not project_id_val:
-            raise ValueError("Watsonx Project ID is not configured. Please set WATSONX_PROJECT_ID in your .env file.")
-        if not model_id_val:
-            raise ValueError("Watsonx Model ID is not configured. Please set MODEL_NAME in your .env file.")
-        
-        # Prepare the API endpoint - ensure proper URL format
-        base_url = url_value.rstrip('/')
-        # Remove http:// or https:// if present, we'll add https://
-        base_url = base_url.replace('http://', '').replace('https://', '')
-        
-        # Construct full URL
-        if not base_url:
-            raise ValueError("Watsonx URL is empty. Please set WATSONX_URL in your .env file (e.g., us-south.ml.cloud.ibm.com)")
-        
-        # Ensure we have a valid hostname
-        if '.' not in base_url:
-            raise ValueError(f"Invalid Watsonx URL format: {base_url}. Expected format: us-south.ml.cloud.ibm.com")
-        
-        full_base_url = f"https://{base_url}"
-        endpoint = f"{full_base_url}/ml/v1/text/generation?version=2023-05-29"
+        # Identical requests in flight on this loop share one task. Every caller, including
+        # the one that started it, awaits it through shield(), so cancelling a caller only
+        # cancels that caller; the request still finishes for the others
+        request_key = self._request_key(prompt)
+        loop = asyncio.get_running_loop()
+        inflight = _inflight_requests.get(loop)
+        if inflight is None:
+            inflight = _inflight_requests[loop] = {}
+        task = inflight.get(request_key)
+        if task is None:
+            task = inflight[request_key] = loop.create_task(self._request_generation(prompt))
+            task.add_done_callback(lambda done: self._finish_request(inflight, request_key, done))
+        return await asyncio.shield(task)
+    
+    @staticmethod
+    def _finish_request(inflight: dict, request_key: bytes, task: asyncio.Task):
+        """Drop a finished request from the in-flight table"""
+        if inflight.get(request_key) is task:
+            del inflight[request_key]
+        # Mark a failure retrieved, so it isn't logged as unhandled if every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+    
+    async def _request_generation(self, prompt: str) -> str:
+        """Send one generation request to Watsonx"""
+        endpoint = self._endpoint
         
         # Watsonx requires IAM access token, not API key directly
         # Get IAM token first
-        iam_token = await self._get_iam_token(api_key_val)
+        iam_token = await self._get_iam_token(self._api_key)
         
         # Prepare headers with IAM token
         headers = {
@@ -181,64 +281,53 @@ class WatsonxLLM(BaseLLM):
             "Accept": "application/json"
         }
         
-        # Debug: Check if API key looks valid (should not be empty and should have some length)
-        if not api_key_val or len(api_key_val.strip()) < 10:
-            raise ValueError(f"Invalid API key format. API key appears to be empty or too short.")
-        
         # Prepare request body for Watsonx API
-        payload = {
-            "input": prompt,
-            "parameters": {
-                "decoding_method": "greedy",
-                "max_new_tokens": self.max_tokens,
-                "temperature": self.temperature,
-                "top_p": 0.9,
-                "repetition_penalty": 1.1,
-                "stop_sequences": []
-            },
-            "model_id": model_id_val,
-            "project_id": project_id_val
-        }
+        payload = {"input": prompt, **self._payload_template}
         
         # Make API call
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            try:
-                response = await client.post(endpoint, headers=headers, json=payload)
-                response.raise_for_status()
-                result = response.json()
+        try:
+            response = await _get_http_client().post(endpoint, headers=headers, content=orjson.dumps(payload))
+            response.raise_for_status()
+            result = orjson.loads(response.content)
+            
+            # Extract generated text
+            if "results" in result and len(result["results"]) > 0:
+                return result["results"][0].get("generated_text", "")
+            else:
+                return "No response generated"
                 
-                # Extract generated text
-                if "results" in result and len(result["results"]) > 0:
-                    generated_text = result["results"][0].get("generated_text", "")
-                    return generated_text
-                else:
-                    return "No response generated"
-                    
-            except httpx.ConnectError as e:
-                error_msg = f"Failed to connect to Watsonx API at {endpoint}. "
-                error_msg += f"Error: {str(e)}. "
-                error_msg += "Please check:\n"
-                error_msg += "1. Your internet connection\n"
-                error_msg += f"2. The WATSONX_URL in .env file (current: {url_value})\n"
-                error_msg += "3. The URL format (should be: us-south.ml.cloud.ibm.com or similar)"
-                raise Exception(error_msg)
-            except httpx.HTTPStatusError as e:
-                error_msg = f"Watsonx API error: {e.response.status_code}"
-                if e.response.text:
-                    try:
-                        error_data = e.response.json()
-                        error_msg += f" - {error_data}"
-                    except:
-                        error_msg += f" - {e.response.text}"
-                raise Exception(error_msg)
-            except Exception as e:
-                error_msg = f"Error calling Watsonx API: {str(e)}"
-                if "getaddrinfo" in str(e).lower() or "11001" in str(e):
-                    error_msg += f"\n\nDNS resolution failed. Check:\n"
-                    error_msg += f"1. WATSONX_URL in .env: {url_value}\n"
-                    error_msg += f"2. Network connectivity\n"
-                    error_msg += f"3. URL format (should be hostname without http://, e.g., us-south.ml.cloud.ibm.com)"
-                raise Exception(error_msg)
+        except httpx.ConnectError as e:
+            error_msg = f"Failed to connect to Watsonx API at {endpoint}. "
+            error_msg += f"Error: {str(e)}. "
+            error_msg += "Please check:\n"
+            error_msg += "1. Your internet connection\n"
+            error_msg += f"2. The WATSONX_URL in .env file (current: {self._base_url})\n"
+            error_msg += "3. The URL format (should be: us-south.ml.cloud.ibm.com or similar)"
+            raise Exception(error_msg)
+        except httpx.HTTPStatusError as e:
+            error_msg = f"Watsonx API error: {e.response.status_code}"
+            if e.response.text:
+                try:
+                    error_data = e.response.json()
+                    error_msg += f" - {error_data}"
+                except:
+                    error_msg += f" - {e.response.text}"
+            raise Exception(error_msg)
+        except Exception as e:
+            error_msg = f"Error calling Watsonx API: {str(e)}"
+            if "getaddrinfo" in str(e).lower() or "11001" in str(e):
+                error_msg += f"\n\nDNS resolution failed. Check:\n"
+                error_msg += f"1. WATSONX_URL in .env: {self._base_url}\n"
+                error_msg += f"2. Network connectivity\n"
+                error_msg += f"3. URL format (should be hostname without http://, e.g., us-south.ml.cloud.ibm.com)"
+            raise Exception(error_msg)
+
+
+class Response:
+    """Minimal stand-in for LangChain's AIMessage: just the generated text as .content"""
+    
+    def __init__(self, content: str):
+        self.content = content
 
 
 class WatsonxChat:
@@ -257,7 +346,21 @@ class WatsonxChat:
     
     async def ainvoke(self, messages: List[BaseMessage]) -> Any:
         """Invoke the LLM with messages and return a response object"""
-        # Convert messages to prompt
+        # Call the LLM
+        response_text = await self.llm._acall(self._format_prompt(messages))
+        
+        # Return a response object that mimics LangChain's response
+        return Response(response_text)
+    
+    async def ainvoke_many(self, batches: List[List[BaseMessage]]) -> List["Response"]:
+        """Invoke the LLM on several message lists concurrently, returning responses in order"""
+        prompts = [self._format_prompt(messages) for messages in batches]
+        texts = await asyncio.gather(*(self.llm._acall(prompt) for prompt in prompts))
+        return [Response(text) for text in texts]
+    
+    @staticmethod
+    def _format_prompt(messages: List[BaseMessage]) -> str:
+        """Convert chat messages to a single text prompt"""
         prompt_parts = []
         for message in messages:
             if isinstance(message, SystemMessage):
@@ -267,15 +370,4 @@ class WatsonxChat:
             else:
                 prompt_parts.append(str(message.content))
         
-        prompt = "\n\n".join(prompt_parts)
-        
-        # Call the LLM
-        response_text = await self.llm._acall(prompt)
-        
-        # Return a response object that mimics LangChain's response
-        class Response:
-            def __init__(self, content: str):
-                self.content = content
-        
-        return Response(response_text)
-
+        return "\n\n".join(prompt_parts)